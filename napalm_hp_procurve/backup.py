@@ -0,0 +1,277 @@
+"""
+Configuration backup of HpProcurve devices.
+
+Configurations are stored content addressed by sha256, so a device whose
+configuration did not change since the previous run costs one hash compare
+and nothing on disk.  Changed configurations are stored as line-level deltas
+against the previous version of the same device, with a full snapshot every
+FULL_SNAPSHOT_INTERVAL versions to keep reconstruction cheap.
+
+Store layout:
+    <root>/hosts/<hostname>.json        - version history of a device
+    <root>/objects/<sha[:2]>/<sha>.gz   - full configuration
+    <root>/deltas/<sha[:2]>/<sha>.gz    - delta from a base version (json)
+"""
+import difflib
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from napalm_hp_procurve.hp_procurve import HpProcurveDriver
+
+logger = logging.getLogger(__name__)
+
+FULL_SNAPSHOT_INTERVAL = 20
+
+
+class ConfigBackupError(Exception):
+    pass
+
+
+def config_digest(lines):
+    """ Return sha256 hex digest of configuration lines """
+    digest = hashlib.sha256()
+    for line in lines:
+        digest.update((line + '\n').encode('utf-8'))
+    return digest.hexdigest()
+
+
+def check_config(lines, retrieve='running'):
+    """ Raise ConfigBackupError if lines do not look like a complete
+    configuration (ex: empty or cut-off read) """
+    if not any(line.strip() for line in lines):
+        raise ConfigBackupError(f'Empty {retrieve} configuration')
+    header = f'{retrieve.capitalize()} configuration:'
+    if header not in (line.strip() for line in lines[:5]):
+        raise ConfigBackupError(f'Missing "{header}" header in {retrieve} configuration')
+
+
+def make_delta(old_lines, new_lines):
+    """ Return list of operations building new_lines from old_lines:
+        ['=', i1, i2] - copy old_lines[i1:i2]
+        ['+', [...]]  - insert lines
+    """
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    delta = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            delta.append(['=', i1, i2])
+        elif tag in ('replace', 'insert'):
+            delta.append(['+', new_lines[j1:j2]])
+    return delta
+
+
+def apply_delta(old_lines, delta):
+    """ Rebuild lines from old_lines and delta returned by make_delta() """
+    new_lines = []
+    for op in delta:
+        if op[0] == '=':
+            new_lines.extend(old_lines[op[1]:op[2]])
+        else:
+            new_lines.extend(op[1])
+    return new_lines
+
+
+class HashingSink(object):
+    """ Collect streamed configuration lines and hash them on the fly """
+
+    def __init__(self):
+        self.lines = []
+        self._digest = hashlib.sha256()
+
+    def __call__(self, line):
+        self.lines.append(line)
+        self._digest.update((line + '\n').encode('utf-8'))
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+
+class ConfigBackupStore(object):
+    """ Deduplicated, delta compressed configuration store on disk """
+
+    def __init__(self, root, full_snapshot_interval=FULL_SNAPSHOT_INTERVAL):
+        self.root = root
+        self.full_snapshot_interval = full_snapshot_interval
+        for directory in ('hosts', 'objects', 'deltas'):
+            os.makedirs(os.path.join(root, directory), exist_ok=True)
+
+    def _path(self, kind, sha):
+        return os.path.join(self.root, kind, sha[:2], sha + '.gz')
+
+    def _host_path(self, hostname):
+        return os.path.join(self.root, 'hosts', hostname + '.json')
+
+    def _write_atomic(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=directory, prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(data)
+            os.replace(tmp_name, path)
+        except Exception:
+            os.unlink(tmp_name)
+            raise
+
+    def _has(self, sha):
+        return os.path.exists(self._path('objects', sha)) or \
+            os.path.exists(self._path('deltas', sha))
+
+    def history(self, hostname):
+        """ Return list of versions of hostname, oldest first:
+            {
+                'sha256': '...',
+                'timestamp': 1571234567.0,  # when it was first seen
+                'last_seen': 1571334567.0,
+                'chain': 3,                 # deltas needed to rebuild it
+            }
+        """
+        try:
+            with open(self._host_path(hostname)) as fh:
+                return json.load(fh)
+        except (IOError, OSError):
+            return []
+
+    def _chain_length(self, sha):
+        """ Return number of deltas needed to rebuild sha """
+        chain = 0
+        while not os.path.exists(self._path('objects', sha)):
+            sha = self._read_delta(sha)['base']
+            chain += 1
+        return chain
+
+    def _read_delta(self, sha):
+        with gzip.open(self._path('deltas', sha), 'rt', encoding='utf-8') as fh:
+            return json.load(fh)
+
+    def load(self, sha):
+        """ Return configuration lines stored under sha """
+        deltas = []
+        while not os.path.exists(self._path('objects', sha)):
+            delta = self._read_delta(sha)
+            deltas.append(delta['ops'])
+            sha = delta['base']
+        with gzip.open(self._path('objects', sha), 'rt', encoding='utf-8') as fh:
+            lines = fh.read().split('\n')[:-1]
+        for ops in reversed(deltas):
+            lines = apply_delta(lines, ops)
+        return lines
+
+    def get(self, hostname, version=-1):
+        """ Return configuration lines of hostname, latest by default """
+        history = self.history(hostname)
+        if not history:
+            raise KeyError(f'No configuration stored for {hostname}')
+        return self.load(history[version]['sha256'])
+
+    def diff(self, hostname, old=-2, new=-1):
+        """ Return unified diff between two versions of hostname.
+        When old does not exist (ex: only one version is stored) the diff is
+        against an empty configuration.
+        """
+        history = self.history(hostname)
+        new_lines = self.get(hostname, new)
+        try:
+            old_lines = self.load(history[old]['sha256'])
+            fromfile = history[old]['sha256']
+        except IndexError:
+            old_lines = []
+            fromfile = '/dev/null'
+        return '\n'.join(difflib.unified_diff(
+            old_lines, new_lines,
+            fromfile=fromfile, tofile=history[new]['sha256'], lineterm=''))
+
+    def commit(self, hostname, lines, sha256=None):
+        """ Store configuration lines of hostname.
+        Return one of 'new', 'changed' or 'unchanged'.
+        """
+        if not lines:
+            raise ValueError(f'Refusing to store empty configuration of {hostname}')
+        if sha256 is None:
+            sha256 = config_digest(lines)
+        now = time.time()
+        history = self.history(hostname)
+        if history and history[-1]['sha256'] == sha256:
+            status = 'unchanged'
+            history[-1]['last_seen'] = now
+        else:
+            status = 'changed' if history else 'new'
+            if self._has(sha256):
+                # Identical configuration already stored (other device or an
+                # older version of this one)
+                chain = self._chain_length(sha256)
+            else:
+                chain = history[-1]['chain'] + 1 if history else 0
+                if chain == 0 or chain >= self.full_snapshot_interval:
+                    chain = 0
+                    data = ''.join(line + '\n' for line in lines)
+                    self._write_atomic(self._path('objects', sha256),
+                                       gzip.compress(data.encode('utf-8')))
+                else:
+                    base = history[-1]['sha256']
+                    delta = {'base': base, 'ops': make_delta(self.load(base), lines)}
+                    self._write_atomic(self._path('deltas', sha256),
+                                       gzip.compress(json.dumps(delta).encode('utf-8')))
+            history.append({
+                'sha256': sha256,
+                'timestamp': now,
+                'last_seen': now,
+                'chain': chain,
+            })
+        self._write_atomic(self._host_path(hostname),
+                           json.dumps(history, indent=4).encode('utf-8'))
+        return status
+
+
+def backup_device(store, hostname, username, password, timeout=60,
+                  optional_args=None, retrieve='running'):
+    """ Stream configuration of one device into store. Return result dict """
+    result = {'hostname': hostname, 'status': 'failed', 'sha256': None, 'error': None}
+    driver = HpProcurveDriver(hostname, username, password, timeout=timeout,
+                              optional_args=optional_args)
+    sink = HashingSink()
+    try:
+        try:
+            driver.open()
+            driver.stream_config(sink, retrieve=retrieve)
+        finally:
+            # open() may fail after connecting (ex: in show version)
+            if driver.device is not None:
+                try:
+                    driver.close()
+                except Exception as e:
+                    logger.error(f' --- {hostname} closing connection failed: {e} ---')
+        check_config(sink.lines, retrieve)
+        result['sha256'] = sink.sha256
+        result['status'] = store.commit(hostname, sink.lines, sink.sha256)
+        msg = f' --- {hostname} configuration {result["status"]} ---'
+        logger.info(msg)
+    except Exception as e:
+        result['error'] = str(e)
+        logger.error(f' --- {hostname} configuration backup failed: {e} ---')
+    return result
+
+
+def backup_devices(store, devices, max_workers=16, retrieve='running'):
+    """ Backup configuration of devices in parallel.
+
+    devices is an iterable of dicts with backup_device() arguments:
+        {
+            'hostname': 'switch1',
+            'username': 'user',
+            'password': 'pass',
+            'optional_args': {...},   # optional
+        }
+    Return list of result dicts in the order of devices.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(backup_device, store, retrieve=retrieve, **device)
+                   for device in devices]
+        return [future.result() for future in futures]
@@ -7,6 +7,8 @@ from netmiko import __version__ as netmiko_version
 
 import sys
 import re
+import time
+import socket
 import logging
 from json import dumps
 
@@ -18,12 +20,32 @@ from napalm.base.exceptions import (
     MergeConfigException,
     ReplaceConfigException,
     CommandErrorException,
+    ConnectionClosedException,
     )
 from napalm.base.helpers import (
     textfsm_extractor,
 )
+from napalm_hp_procurve.utils.timing import (
+    TimingProfileStore,
+    DEFAULT_PROFILE_FILE,
+    DEFAULT_DELAY_FACTOR,
+    NETMIKO_FINAL_DELAY,
+    PAGER_MARKERS,
+    POLL_INTERVAL,
+)
+from napalm_hp_procurve.utils.mac_table import MacAddressTable
 logger = logging.getLogger(__name__)
 
+# Secrets removed from configurations by get_config(sanitized=True)
+HP_PROCURVE_SANITIZE_FILTERS = {
+    r'^(password \S+(?: user-name \S+)? (?:sha1|sha-256|plaintext)) \S+':
+        r'\1 "<removed>"',
+    r'^(snmp-server community) \S+': r'\1 "<removed>"',
+    r'^((?:radius|tacacs)-server (?:host \S+ )?(?:encrypted-)?key) \S+': r'\1 "<removed>"',
+    r'^(snmpv3 user \S+ auth \S+) \S+': r'\1 "<removed>"',
+    r'^(snmpv3 user .* priv \S+) \S+': r'\1 "<removed>"',
+}
+
 
 class HpProcurvePrivilegeError(Exception):
     pass
@@ -50,6 +72,13 @@ class HpProcurveDriver(NetworkDriver):
             - proxy_username - hopping station username
             - proxy_password - hopping station password
             - proxy_port - hopping station ssh port
+            - model - device model used as timing profile key (ex: J9728A)
+            - adaptive_timing - learn time to first byte and gaps between
+              chunks of command output and size from them how long a command
+              may stay silent before its read is given up, and netmiko's
+              global_delay_factor of the next sessions (default: True)
+            - timing_profile_file - where timing profiles are persisted
+              (default: /var/tmp/napalm_hp_procurve_timing.json)
             TODO: 
                 Set proxy host to work with user/password 
                 (works only with preloaded ssh-key in the ssh-agent for now)
@@ -69,7 +98,15 @@ class HpProcurveDriver(NetworkDriver):
         self.proxy_username = optional_args.get('proxy_username', None)
         self.proxy_password = optional_args.get('proxy_password', None)
         self.proxy_port = optional_args.get('proxy_port', None)
-       
+
+        # adaptive timing part
+        self.model = optional_args.get('model', None)
+        self.timing_profile = None
+        if optional_args.get('adaptive_timing', True):
+            self.timing_store = TimingProfileStore(
+                optional_args.get('timing_profile_file', DEFAULT_PROFILE_FILE))
+        else:
+            self.timing_store = None
 
         # Check for proxy parameters and generate ssh config file
         if self.proxy_host:
@@ -136,6 +173,13 @@ class HpProcurveDriver(NetworkDriver):
  
     def open(self):
         """Open a connection to the device."""
+        if self.timing_store:
+            # Use profile learned in previous sessions until the os_version
+            # of the device is known
+            self.timing_profile = self.timing_store.for_host(self.hostname)
+            if self.timing_profile and 'global_delay_factor' not in self.netmiko_optional_args:
+                self.netmiko_optional_args['global_delay_factor'] = \
+                    self.timing_profile.global_delay_factor()
         self.device = ConnectHandler(
                 device_type = 'hp_procurve',
                 host = self.hostname,
@@ -148,6 +192,119 @@ class HpProcurveDriver(NetworkDriver):
     def close(self):
         """Close the connection to the device."""
         self.device.disconnect()
+        if self.timing_store:
+            try:
+                self.timing_store.save()
+            except Exception as e:
+                logger.error(f'Saving timing profiles failed: {e}')
+
+    def _bind_timing_profile(self, os_version):
+        """ Switch to timing profile of the model / os_version family """
+        if not self.timing_store:
+            return
+        profile = self.timing_store.get(self.model, os_version)
+        if profile is not self.timing_profile:
+            self.timing_profile = profile
+            self.timing_store.bind_host(self.hostname, profile)
+
+    def _idle_timeout(self, command):
+        """ Return seconds the device may stay silent during command """
+        if self.timing_profile is None:
+            return NETMIKO_FINAL_DELAY * DEFAULT_DELAY_FACTOR
+        return self.timing_profile.idle_timeout(command)
+
+    def _record_timing(self, command, first_byte, max_gap, prompt_seen):
+        if self.timing_profile is not None:
+            self.timing_profile.record(command, first_byte or 0.0, max_gap, prompt_seen)
+
+    def _read_command(self, command, sink):
+        """ Send command and pass its output to sink(line) line by line while
+        it is being read, so big outputs are never held as one string.
+        Pager prompts are answered, command echo and trailing prompt are
+        dropped. The channel is polled every POLL_INTERVAL seconds until the
+        prompt is seen or the device is silent for longer than the timing
+        profile allows.
+        Return (prompt_seen, first_byte, max_gap, lines) where first_byte is
+        the time to the first output and max_gap the longest silence between
+        two chunks of output.
+        """
+        idle_timeout = self._idle_timeout(command)
+        prompt = re.compile(re.escape(self.device.base_prompt) + r'.*[#>]\s*$')
+        self.device.clear_buffer()
+        self.device.write_channel(command + self.device.RETURN)
+        sent = last_read = time.time()
+        first_byte = None
+        max_gap = 0.0
+        pending = ''
+        echo = True
+        lines = 0
+        while True:
+            chunk = self.device.read_channel()
+            now = time.time()
+            if not chunk:
+                if now - last_read > idle_timeout:
+                    return False, first_byte, max_gap, lines
+                time.sleep(POLL_INTERVAL)
+                continue
+            if first_byte is None:
+                first_byte = now - sent
+            else:
+                max_gap = max(max_gap, now - last_read)
+            last_read = now
+            pending += self.device.strip_ansi_escape_codes(chunk)
+            complete = pending.split('\n')
+            pending = complete.pop()
+            for line in complete:
+                line = line.rstrip('\r')
+                if echo and command in line:
+                    echo = False
+                    continue
+                echo = False
+                sink(line)
+                lines += 1
+            if any(marker in pending for marker in PAGER_MARKERS):
+                self.device.write_channel(' ')
+                pending = ''
+            elif prompt.search(pending):
+                return True, first_byte, max_gap, lines
+
+    def _drain_channel(self, command):
+        """ Read and drop what is left of command output after the read was
+        given up, quit the pager if the device is still in it """
+        idle_timeout = self._idle_timeout(command)
+        prompt = re.compile(re.escape(self.device.base_prompt) + r'.*[#>]\s*$')
+        tail = ''
+        last_read = time.time()
+        while time.time() - last_read <= idle_timeout:
+            chunk = self.device.read_channel()
+            if not chunk:
+                time.sleep(POLL_INTERVAL)
+                continue
+            last_read = time.time()
+            tail = (tail + self.device.strip_ansi_escape_codes(chunk))[-200:]
+            if any(marker in tail for marker in PAGER_MARKERS):
+                self.device.write_channel('q')
+                tail = ''
+            elif prompt.search(tail):
+                break
+        self.device.clear_buffer()
+
+    def _send_timed(self, command):
+        """ Return output of command and record its timing.
+        Retry once with backed off timing if the prompt was not seen and
+        raise CommandErrorException if the retry misses it too, so partial
+        output is never returned as complete.
+        """
+        for attempt in range(2):
+            output = []
+            prompt_seen, first_byte, max_gap, lines = self._read_command(
+                command, output.append)
+            self._record_timing(command, first_byte, max_gap, prompt_seen)
+            if prompt_seen:
+                return '\n'.join(output).rstrip('\n')
+            self._drain_channel(command)
+        raise CommandErrorException(
+            f'Timeout while reading output of "{command}" after {lines} lines')
 
     def _send_command(self, command):
         """ Wrapper for self.device.send.command().
@@ -156,24 +313,36 @@ class HpProcurveDriver(NetworkDriver):
         try:
             if isinstance(command, list):
                 for cmd in command:
-                    output = self.device.send_command(cmd)
+                    output = self._send_timed(cmd)
                     if "% Unrecognized" not in output:
                         break
             else:
-                # TODO: Why send_command_timing() works and send_command()
-                # doesn't 
-                # output = self.device.send_command(command)
-                output = self.device.send_command_timing(command)
+                output = self._send_timed(command)
             return output
         except (socket.error, EOFError) as e:
             raise ConnectionClosedException(str(e))
 
+    def _stream_command(self, command, sink):
+        """ Send command and pass its output to sink(line) line by line while
+        it is being read. Return number of lines passed to sink.
+        """
+        try:
+            prompt_seen, first_byte, max_gap, lines = self._read_command(command, sink)
+            self._record_timing(command, first_byte, max_gap, prompt_seen)
+            if not prompt_seen:
+                self._drain_channel(command)
+                raise CommandErrorException(
+                    f'Timeout while reading output of "{command}" after {lines} lines')
+        except (socket.error, EOFError) as e:
+            raise ConnectionClosedException(str(e))
+        return lines
+
     def get_current_privilege(self):
         """ Get current privilege 
             "show telnet" output depends on os_version of the device !!!@#!@#!#$
         """
-        raw_out = self.device.send_command_timing('show telnet', delay_factor=2)
         dev_version = self.get_version()
+        raw_out = self._send_command('show telnet')
         if dev_version.startswith(('K.','YA.','WC.')):
             show_telnet_entries = textfsm_extractor(self, "show_telnet_vK", raw_out)
         else:
@@ -234,7 +403,7 @@ class HpProcurveDriver(NetworkDriver):
                 raise HpProcurvePrivilegeError
 
 
-    def get_mac_address_table(self, raw_mac_table=None):
+    def get_mac_address_table(self, raw_mac_table=None, compact=False):
 
         """
         Returns a lists of dictionaries. Each dictionary represents an entry in the MAC Address
@@ -279,20 +448,29 @@ class HpProcurveDriver(NetworkDriver):
                     'last_move' : None
                 }
             ]
+
+        With compact=True a MacAddressTable is returned instead. It stores the
+        entries in arrays with interned interface and state strings and
+        integer macs, and behaves as a read-only list of dicts like the above.
+        Its dicts use NAPALM types (int vlan, bool static/active, lowercase
+        mac) while the default output keeps the TextFSM strings. It is not a
+        list: call to_list() before serializing it (ex: json.dumps).
         """
         if raw_mac_table is not None:
             if 'No mac address found' in raw_mac_table:
                 return ['No mac address found']
-            out_mac_table = raw_mac_table
+            raw_out = raw_mac_table
         else:
             # Disable Pageing of the device
             self.disable_pageing()
-        raw_out = self._send_command('show mac-address')
+            raw_out = self._send_command('show mac-address')
         dev_version = self.get_version()
         if dev_version.startswith(('K.','YA.','WC.')):
             mac_table_entries = textfsm_extractor(self, "show_mac_address_all_vK", raw_out)
         else: 
             mac_table_entries = textfsm_extractor(self, "show_mac_address_all", raw_out)
+        if compact:
+            return MacAddressTable.from_rows(mac_table_entries, self.normalize_port_name)
         # owerwrite some values in order to be compliant 
         for row in mac_table_entries:                                            
             row['mac'] = self.format_mac_cisco_way(row['mac'])                   
@@ -301,33 +479,9 @@ class HpProcurveDriver(NetworkDriver):
 
 
     def normalize_port_name(self,res_port):
-        """ Convert Short HP interface names to long (ex: BAGG519 --> Bridge-Aggregation 519)"""
-        raise NotImplementedError
-        # if re.match('^BAGG\d+',res_port):
-        #     # format port BAGG519 --> Bridge-Aggregation 519
-        #     agg_port_name = res_port.replace('BAGG','Bridge-Aggregation ')
-        #     return agg_port_name
-        # elif re.match('^Bridge-Aggregation\d*',res_port):
-        #     agg_port_name = res_port
-        #     return agg_port_name
-        # elif re.match('^XGE\d.*',res_port):
-        #     # format port XGE1/2/0/7 --> Ten-GigabitEthernet 1/2/0/7
-        #     port_name = res_port.replace('XGE','Ten-GigabitEthernet ')
-        #     # print(" --- Port Name: "+'\x1b[1;32;40m' +"{}" .format(port_name)+'\x1b[0m')
-        #     return port_name
-        # elif re.match('^GE\d.*',res_port):
-        #     # format port GE1/5/0/19 --> GigabitEthernet 1/5/0/19
-        #     port_name = res_port.replace('GE','GigabitEthernet ')
-        #     # print(" --- Port Name: "+'\x1b[1;32;40m' +"{}" .format(port_name)+'\x1b[0m')
-        #     return port_name
-        # elif re.match('^Vlan\d+',res_port):
-        #     # format port Vlan4003 --> Vlan-interface4003
-        #     port_name = res_port.replace('Vlan','Vlan-interface')
-        #     # print(" --- Port Name: "+'\x1b[1;32;40m' +"{}" .format(port_name)+'\x1b[0m')
-        #     return port_name
-        # else:
-        #     return res_port 
-        #     # print('\x1b[1;31;40m' + " --- Unknown Port Name: {} --- ".format(res_port)+'\x1b[0m')
+        """ Procurve port names (ex: A23, Trk1, 1/1/24) are already in the
+        form used everywhere else so they are returned as they are """
+        return res_port
 
 
     
@@ -443,11 +597,63 @@ class HpProcurveDriver(NetworkDriver):
             print("Disable Pageing cli command error: {}".format(out_disable_pageing))
             raise e
 
+    def stream_config(self, sink, retrieve='running'):
+        """ Pass 'running' or 'startup' configuration to sink(line) line by
+        line while it is read from the device. Return number of lines.
+        """
+        commands = {
+            'running': 'show running-config',
+            'startup': 'show config',
+        }
+        if retrieve not in commands:
+            raise ValueError(f'Unknown configuration: {retrieve}')
+        # show running-config is available only in manager level
+        self.privilege_escalation()
+        self.disable_pageing()
+        return self._stream_command(commands[retrieve], sink)
+
+    def get_config(self, retrieve='all', full=False, sanitized=False, format='text'):
+        """ Return the configuration of the device.
+
+        Procurve has no candidate configuration so it is always empty.
+        {
+            'running': '...',
+            'startup': '...',
+            'candidate': '',
+        }
+        full and non-text formats are not supported. With sanitized=True
+        passwords, keys and communities are replaced with "<removed>".
+        """
+        if full:
+            raise NotImplementedError('full configuration is not supported on Procurve')
+        if format != 'text':
+            raise NotImplementedError(f'{format} configuration format is not supported')
+        configs = {
+            'running': '',
+            'startup': '',
+            'candidate': '',
+        }
+        for config in ('running', 'startup'):
+            if retrieve in ('all', config):
+                config_lines = []
+                self.stream_config(config_lines.append, retrieve=config)
+                configs[config] = '\n'.join(config_lines)
+                if sanitized:
+                    configs[config] = self._sanitize_config(configs[config])
+        return configs
+
+    def _sanitize_config(self, config):
+        """ Replace secrets in config with "<removed>" """
+        for pattern, replacement in HP_PROCURVE_SANITIZE_FILTERS.items():
+            config = re.sub(pattern, replacement, config, flags=re.M)
+        return config
+
     def get_version(self):
         """ Return procurve version, vendor, model and uptime.  """
         raw_out = self._send_command('show version')
         version_entries = textfsm_extractor(self, "show_version", raw_out)
         version = version_entries[0]['os_version']
+        self._bind_timing_profile(version)
         return str(version)
 
 
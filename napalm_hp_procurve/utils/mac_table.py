@@ -0,0 +1,176 @@
+"""Memory-compact MAC address table.
+
+TextFSM returns one dict per MAC address entry with its own copies of the
+interface, vlan and state strings plus keys the driver never fills.  For a
+switch with thousands of MACs learned on a few trunks most of that memory is
+duplicated strings.  MacAddressTable keeps the entries in typed arrays:
+
+    * mac       - 48 bit integer in array('Q')
+    * vlan      - integer in array('H')
+    * interface - index into a list of interned interface names
+    * state     - index into a list of interned states (Learned, ...)
+
+and builds NAPALM dicts only when an entry is accessed.
+
+The table is not a list, so json.dumps() and other serializers do not accept
+it as is.  Use table.to_list(), or json.dumps(table, default=json_default).
+"""
+import sys
+from array import array
+from collections.abc import Sequence
+
+
+def mac_to_int(mac):
+    """ Convert mac in any of 'd07e28-cfabcd', 'd07e-28cf-abcd' or
+    'd0:7e:28:cf:ab:cd' formats to integer """
+    return int(mac.replace('-', '').replace(':', '').replace('.', ''), 16)
+
+
+def json_default(obj):
+    """ json.dumps() default serializing MacAddressTable as a list of dicts """
+    if isinstance(obj, MacAddressTable):
+        return obj.to_list()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def int_to_mac(value):
+    """ Convert integer to mac formatted with ":" aa:bb:cc:dd:ee:ff """
+    mac = '{:012x}'.format(value)
+    return ':'.join(mac[idx:idx + 2] for idx in range(0, 12, 2))
+
+
+class MacAddressTable(Sequence):
+    """ Array backed MAC address table.
+
+    Behaves as a read-only list of NAPALM get_mac_address_table() dicts:
+        {
+            'mac'       : 'd0:7e:28:cf:ab:cd',
+            'interface' : 'Trk1',
+            'vlan'      : 1,
+            'static'    : False,
+            'active'    : True,
+            'moves'     : -1,
+            'last_move' : -1.0,
+        }
+
+    These dicts follow the NAPALM types and differ from the default
+    get_mac_address_table() output, which keeps the TextFSM strings: vlan is
+    an int instead of '1', static/active are bools and moves/last_move are
+    -1/-1.0 instead of '', mac is always lowercase, and the TextFSM only keys
+    (state, aging) are not included.
+
+    Comparing with == works against another table or any list of such dicts.
+    """
+    __slots__ = ('_macs', '_vlans', '_interfaces', '_states',
+                 '_interface_names', '_interface_index', '_state_names', '_state_index')
+
+    def __init__(self):
+        self._macs = array('Q')
+        self._vlans = array('H')
+        self._interfaces = array('H')
+        self._states = array('B')
+        self._interface_names = []
+        self._interface_index = {}
+        self._state_names = []
+        self._state_index = {}
+
+    @classmethod
+    def from_rows(cls, rows, normalize_port_name=None):
+        """ Build table from show_mac_address textfsm rows """
+        table = cls()
+        for row in rows:
+            interface = row['interface']
+            if normalize_port_name is not None:
+                interface = normalize_port_name(interface)
+            table.append(row['mac'], interface, row['vlan'], row.get('state', ''))
+        return table
+
+    @staticmethod
+    def _intern(value, names, index):
+        try:
+            return index[value]
+        except KeyError:
+            value = sys.intern(value)
+            index[value] = len(names)
+            names.append(value)
+            return index[value]
+
+    def append(self, mac, interface, vlan, state=''):
+        """ Add entry, mac may be a string or an integer """
+        if not isinstance(mac, int):
+            mac = mac_to_int(mac)
+        self._macs.append(mac)
+        self._vlans.append(int(vlan))
+        self._interfaces.append(
+            self._intern(interface, self._interface_names, self._interface_index))
+        self._states.append(
+            self._intern(state, self._state_names, self._state_index))
+
+    __hash__ = None
+
+    def __eq__(self, other):
+        if isinstance(other, MacAddressTable):
+            return list(self.rows()) == list(other.rows())
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and all(
+                entry == other_entry for entry, other_entry in zip(self, other))
+        return NotImplemented
+
+    def __len__(self):
+        return len(self._macs)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._entry(i) for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('MacAddressTable index out of range')
+        return self._entry(idx)
+
+    def _entry(self, idx):
+        state = self._state_names[self._states[idx]]
+        return {
+            'mac': int_to_mac(self._macs[idx]),
+            'interface': self._interface_names[self._interfaces[idx]],
+            'vlan': self._vlans[idx],
+            'static': 'static' in state.lower(),
+            'active': True,
+            'moves': -1,
+            'last_move': -1.0,
+        }
+
+    def rows(self):
+        """ Yield compact (mac int, interface, vlan, state) tuples without
+        building dicts """
+        interface_names = self._interface_names
+        state_names = self._state_names
+        for mac, vlan, interface, state in zip(
+                self._macs, self._vlans, self._interfaces, self._states):
+            yield mac, interface_names[interface], vlan, state_names[state]
+
+    def find(self, mac):
+        """ Return list of entries (dicts) of mac """
+        value = mac if isinstance(mac, int) else mac_to_int(mac)
+        return [self._entry(idx) for idx, entry in enumerate(self._macs) if entry == value]
+
+    def to_list(self):
+        """ Return list of NAPALM dicts, use it where a plain list is needed
+        (ex: json.dumps, the napalm cli) """
+        return list(self)
+
+    @property
+    def interfaces(self):
+        """ Return list of distinct interfaces in the table """
+        return list(self._interface_names)
+
+    def memory_size(self):
+        """ Return approximate size of the table in bytes """
+        size = sys.getsizeof(self)
+        for arr in (self._macs, self._vlans, self._interfaces, self._states):
+            size += sys.getsizeof(arr)
+        for names, index in ((self._interface_names, self._interface_index),
+                             (self._state_names, self._state_index)):
+            size += sys.getsizeof(names) + sys.getsizeof(index)
+            size += sum(sys.getsizeof(name) for name in names)
+        return size
@@ -0,0 +1,278 @@
+"""Adaptive per-model timing profiles for HP Procurve devices.
+
+The driver reads command output from the channel itself and stops as soon as
+the prompt comes back.  The only thing left to tune is how long the device may
+stay silent before the read is given up: before the first byte of output and
+between two chunks of it.  A single hard-coded value makes every switch wait
+as long as the slowest one when something goes wrong, and netmiko's
+``global_delay_factor`` slows down every login as well.
+
+The classes here keep a running estimate of each command's time to first byte
+and of the largest gap between output chunks, per model and firmware family,
+persist it between sessions and turn it into an idle timeout for the driver
+and a ``delay_factor`` for netmiko.  The total transfer time of a command is
+deliberately not used: a command with a lot of output is not a slow one.
+"""
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE_FILE = '/var/tmp/napalm_hp_procurve_timing.json'
+
+# Netmiko stops reading after 2 * delay_factor seconds of silence
+NETMIKO_FINAL_DELAY = 2.0
+# Delay factor used for commands that were never measured. Matches the value
+# the driver has always used, so unknown switches are not made faster.
+DEFAULT_DELAY_FACTOR = 2.0
+MIN_DELAY_FACTOR = 0.5
+MAX_DELAY_FACTOR = 8.0
+# Login and session preparation are never measured, so the connection itself
+# is not made faster than netmiko's default
+MIN_GLOBAL_DELAY_FACTOR = 1.0
+# The silence allowed is this many times the longest pause observed
+SILENCE_MARGIN = 2.0
+# Seconds between channel reads of the driver
+POLL_INTERVAL = 0.05
+# Weight of the newest sample in the moving averages.
+EWMA_ALPHA = 0.3
+# Multiplier applied to a command after its prompt was not seen in time, and
+# the rate at which it (and the longest pause) decays on clean responses.
+BACKOFF_FACTOR = 2.0
+BACKOFF_DECAY = 0.9
+
+PAGER_MARKERS = ('-- MORE --', 'MORE --, next page')
+
+_save_lock = threading.Lock()
+
+
+def os_version_family(os_version):
+    """ Return firmware family of an os_version (ex: WC.16.10.0009 --> WC.16) """
+    return '.'.join(str(os_version).split('.')[:2])
+
+
+def profile_key(model, os_version):
+    """ Return the key profiles are stored under """
+    return '{}|{}'.format(model or 'unknown', os_version_family(os_version))
+
+
+def merge_stats(ours, theirs):
+    """ Merge statistics of one command written by two drivers: keep the
+    most recently updated entry but the larger backoff of the two """
+    if not theirs or 'first_byte' not in theirs:
+        return ours
+    merged = dict(ours if ours.get('updated', 0) >= theirs.get('updated', 0) else theirs)
+    merged['backoff'] = max(ours['backoff'], theirs['backoff'])
+    return merged
+
+
+def command_key(command):
+    """ Strip arguments from a command so 'show mac-address 0011-2233-4455'
+    and 'show mac-address' share statistics """
+    return ' '.join(command.split()[:2])
+
+
+class TimingProfile(object):
+    """ Response timing statistics of one model / firmware family.
+
+    Stored as dict:
+        {
+            'commands': {
+                'show version': {
+                    'first_byte': 0.2,   # moving average in seconds
+                    'max_gap': 0.1,      # moving average of the largest gap
+                    'pause': 0.3,        # longest pause, decays over time
+                    'samples': 12,
+                    'backoff': 1.0,
+                    'updated': 1571234567.0,
+                }
+            },
+            'updated': 1571234567.0,
+        }
+    """
+
+    def __init__(self, key, data=None):
+        self.key = key
+        self.data = data or {'commands': {}, 'updated': None}
+        self.data.setdefault('commands', {})
+        # Forget statistics saved in an older format
+        for command, stats in list(self.data['commands'].items()):
+            if 'first_byte' not in stats:
+                del self.data['commands'][command]
+        # keys of the commands recorded since the last save
+        self.changed = set()
+
+    @property
+    def dirty(self):
+        return bool(self.changed)
+
+    def _stats(self, command):
+        return self.data['commands'].get(command_key(command))
+
+    def record(self, command, first_byte, max_gap, prompt_seen=True):
+        """ Add a timing sample of command.
+
+        first_byte is the time from sending the command to the first output,
+        max_gap the longest silence between two chunks of output.  When the
+        prompt was not seen the read gave up too early and the command's
+        timeout is doubled instead.
+        """
+        stats = self.data['commands'].setdefault(
+            command_key(command),
+            {'first_byte': None, 'max_gap': 0.0, 'pause': 0.0, 'samples': 0, 'backoff': 1.0})
+        if not prompt_seen:
+            stats['backoff'] = min(stats['backoff'] * BACKOFF_FACTOR,
+                                   MAX_DELAY_FACTOR / MIN_DELAY_FACTOR)
+            msg = f' --- No prompt after "{command}" ({self.key}), backing off ---'
+            logger.info(msg)
+        else:
+            if stats['first_byte'] is None:
+                stats['first_byte'] = first_byte
+                stats['max_gap'] = max_gap
+            else:
+                stats['first_byte'] += EWMA_ALPHA * (first_byte - stats['first_byte'])
+                stats['max_gap'] += EWMA_ALPHA * (max_gap - stats['max_gap'])
+            stats['pause'] = max(first_byte, max_gap, stats['pause'] * BACKOFF_DECAY)
+            stats['samples'] += 1
+            stats['backoff'] = max(stats['backoff'] * BACKOFF_DECAY, 1.0)
+        stats['updated'] = self.data['updated'] = time.time()
+        self.changed.add(command_key(command))
+
+    def delay_factor(self, command):
+        """ Return netmiko delay_factor for command.
+
+        The silence window (2 * delay_factor seconds) is sized to
+        SILENCE_MARGIN times the longest pause observed before or within the
+        output, multiplied by the backoff.
+        """
+        stats = self._stats(command)
+        if stats is None:
+            return DEFAULT_DELAY_FACTOR
+        if stats['first_byte'] is None:
+            factor = DEFAULT_DELAY_FACTOR * stats['backoff']
+        else:
+            pause = max(stats['pause'], stats['first_byte'], stats['max_gap'])
+            factor = SILENCE_MARGIN * pause / NETMIKO_FINAL_DELAY * stats['backoff']
+        return round(min(max(factor, MIN_DELAY_FACTOR), MAX_DELAY_FACTOR), 2)
+
+    def idle_timeout(self, command):
+        """ Return seconds the device may stay silent during command """
+        return NETMIKO_FINAL_DELAY * self.delay_factor(command)
+
+    def global_delay_factor(self):
+        """ Return delay factor for the connection itself.
+
+        Netmiko uses max(global_delay_factor, delay_factor) for every command,
+        so this is the smallest measured per-command factor, but never below
+        MIN_GLOBAL_DELAY_FACTOR as login is not measured.
+        """
+        factors = [self.delay_factor(cmd) for cmd, stats in self.data['commands'].items()
+                   if stats['first_byte'] is not None]
+        if not factors:
+            return DEFAULT_DELAY_FACTOR
+        return max(min(factors), MIN_GLOBAL_DELAY_FACTOR)
+
+
+class TimingProfileStore(object):
+    """ JSON file with timing profiles keyed by model and firmware family.
+
+    File layout:
+        {
+            'hosts': {'switch1.example.com': 'J9728A|WB.16'},
+            'profiles': {'J9728A|WB.16': {...TimingProfile data...}},
+        }
+
+    The host index lets a new session pick its profile before it is connected
+    and knows the firmware version.  Several drivers (threads or processes) may
+    share one file, so save() re-reads it under a file lock and merges the
+    commands this store recorded one by one (see merge_stats()).
+    """
+
+    def __init__(self, filename=DEFAULT_PROFILE_FILE):
+        self.filename = filename
+        self.profiles = {}
+        self.hosts = {}
+        self._load()
+
+    def _read_file(self):
+        try:
+            with open(self.filename) as fh:
+                data = json.load(fh)
+        except (IOError, OSError):
+            return {'hosts': {}, 'profiles': {}}
+        except ValueError as e:
+            logger.warning(f'Ignoring corrupt timing profile file {self.filename}: {e}')
+            return {'hosts': {}, 'profiles': {}}
+        data.setdefault('hosts', {})
+        data.setdefault('profiles', {})
+        return data
+
+    def _load(self):
+        data = self._read_file()
+        self.hosts = data['hosts']
+        self.profiles = dict(
+            (key, TimingProfile(key, value)) for key, value in data['profiles'].items())
+        self._dirty_hosts = set()
+
+    def get(self, model, os_version):
+        """ Return (and create if missing) profile of model / os_version """
+        key = profile_key(model, os_version)
+        if key not in self.profiles:
+            self.profiles[key] = TimingProfile(key)
+        return self.profiles[key]
+
+    def for_host(self, hostname):
+        """ Return profile the host used in its previous session or None """
+        key = self.hosts.get(hostname)
+        if key is None:
+            return None
+        return self.profiles.get(key)
+
+    def bind_host(self, hostname, profile):
+        """ Remember which profile hostname uses """
+        if self.hosts.get(hostname) != profile.key:
+            self.hosts[hostname] = profile.key
+            self._dirty_hosts.add(hostname)
+
+    def save(self):
+        """ Merge changed commands and hosts into the file and write it
+        atomically. The read-modify-write runs under an exclusive lock of
+        <filename>.lock so drivers in other threads or processes sharing the
+        file do not drop each other's samples.
+        """
+        dirty = [p for p in self.profiles.values() if p.dirty]
+        if not dirty and not self._dirty_hosts:
+            return
+        with _save_lock, open(self.filename + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            data = self._read_file()
+            for hostname in self._dirty_hosts:
+                data['hosts'][hostname] = self.hosts[hostname]
+            for profile in dirty:
+                saved = data['profiles'].setdefault(profile.key, {'commands': {}})
+                saved['commands'] = dict(
+                    (command, stats) for command, stats in saved.get('commands', {}).items()
+                    if 'first_byte' in stats)
+                for command in profile.changed:
+                    saved['commands'][command] = merge_stats(
+                        profile.data['commands'][command], saved['commands'].get(command))
+                saved['updated'] = max(saved.get('updated') or 0, profile.data['updated'])
+                # pick up what the other drivers learned
+                profile.data = saved
+            directory = os.path.dirname(self.filename) or '.'
+            fd, tmp_name = tempfile.mkstemp(dir=directory, prefix='.timing_')
+            try:
+                with os.fdopen(fd, 'w') as fh:
+                    json.dump(data, fh, sort_keys=True, indent=4)
+                os.replace(tmp_name, self.filename)
+            except Exception:
+                os.unlink(tmp_name)
+                raise
+        for profile in dirty:
+            profile.changed = set()
+        self._dirty_hosts = set()
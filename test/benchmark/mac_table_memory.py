@@ -0,0 +1,89 @@
+"""Memory benchmark of get_mac_address_table() output.
+
+Compares retained memory of the default list of dicts with the compact
+MacAddressTable for synthetic "show mac-address" tables shaped like the
+textfsm output of K.xx devices (few trunks, many macs).
+
+    $ python test/benchmark/mac_table_memory.py --switches 200 --macs 4000
+"""
+import argparse
+import random
+import tracemalloc
+
+from napalm_hp_procurve.utils.mac_table import MacAddressTable
+
+PORTS = ['Trk1', 'Trk2', 'A1', 'A2', 'A23', 'B4', 'E24']
+VLANS = ['1', '10', '20', '100', '4003']
+
+
+def parsed(value):
+    """ Return a new copy of value, as every textfsm match is a new string """
+    return (value + ' ')[:-1]
+
+
+def textfsm_rows(macs, seed):
+    """ Return rows like textfsm_extractor() with show_mac_address_all_vK,
+    every value is a separate string object as it is when parsed """
+    rnd = random.Random(seed)
+    rows = []
+    for _ in range(macs):
+        mac = '{:06x}-{:06x}'.format(rnd.getrandbits(24), rnd.getrandbits(24))
+        rows.append({
+            'mac': mac,
+            'interface': parsed(rnd.choice(PORTS)),
+            'vlan': parsed(rnd.choice(VLANS)),
+            'static': '',
+            'active': '',
+            'moves': '',
+            'last_move': '',
+            'state': parsed('Learned'),
+            'aging': parsed('AGING'),
+        })
+    return rows
+
+
+def format_mac_cisco_way(mac):
+    """ Same as HpProcurveDriver.format_mac_cisco_way() """
+    mac = mac.replace('-', '')
+    return ':'.join(mac[idx:idx + 2] for idx in range(0, 12, 2))
+
+
+def measure(build, switches, macs):
+    """ Return bytes retained by build() results of all switches """
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    tables = []
+    for seed in range(switches):
+        tables.append(build(textfsm_rows(macs, seed)))
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return size
+
+
+def build_dicts(rows):
+    for row in rows:
+        row['mac'] = format_mac_cisco_way(row['mac'])
+    return rows
+
+
+def build_compact(rows):
+    return MacAddressTable.from_rows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--switches', type=int, default=100)
+    parser.add_argument('--macs', type=int, default=2000)
+    args = parser.parse_args()
+
+    dicts = measure(build_dicts, args.switches, args.macs)
+    compact = measure(build_compact, args.switches, args.macs)
+    entries = args.switches * args.macs
+    print(f' --- {args.switches} switches x {args.macs} macs ---')
+    print(f' list of dicts:   {dicts / 2 ** 20:8.1f} MiB ({dicts / entries:6.1f} B/entry)')
+    print(f' MacAddressTable: {compact / 2 ** 20:8.1f} MiB ({compact / entries:6.1f} B/entry)')
+    print(f' savings:         {100 * (1 - compact / dicts):8.1f} %')
+
+
+if __name__ == '__main__':
+    main()
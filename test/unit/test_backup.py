@@ -0,0 +1,171 @@
+"""Tests for the configuration backup store."""
+
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from napalm_hp_procurve import backup
+from napalm_hp_procurve.backup import ConfigBackupStore, HashingSink, config_digest
+
+
+def make_config(version, size=200):
+    lines = ['Running configuration:', '', 'hostname "switch1"']
+    lines += ['vlan {}'.format(idx) for idx in range(size)]
+    lines[10 + version] = 'vlan changed {}'.format(version)
+    return lines
+
+
+def count_files(root, kind):
+    return sum(len(files) for _, _, files in os.walk(os.path.join(root, kind)))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ConfigBackupStore(str(tmp_path), full_snapshot_interval=3)
+
+
+class TestConfigBackupStore(object):
+    """Test round trip, deduplication and snapshots."""
+
+    def test_round_trip(self, store):
+        configs = [make_config(version) for version in range(7)]
+        statuses = [store.commit('switch1', config) for config in configs]
+        assert statuses == ['new'] + ['changed'] * 6
+        for version, config in enumerate(configs):
+            assert store.get('switch1', version) == config
+
+    def test_unchanged_is_not_stored_again(self, store):
+        store.commit('switch1', make_config(0))
+        assert store.commit('switch1', make_config(0)) == 'unchanged'
+        assert len(store.history('switch1')) == 1
+        assert count_files(store.root, 'objects') == 1
+        assert count_files(store.root, 'deltas') == 0
+
+    def test_identical_configs_are_shared(self, store):
+        store.commit('switch1', make_config(0))
+        assert store.commit('switch2', make_config(0)) == 'new'
+        assert count_files(store.root, 'objects') == 1
+        assert store.get('switch2') == make_config(0)
+
+    def test_snapshot_interval(self, store):
+        for version in range(7):
+            store.commit('switch1', make_config(version))
+        assert [entry['chain'] for entry in store.history('switch1')] == [0, 1, 2, 0, 1, 2, 0]
+        assert count_files(store.root, 'objects') == 3
+        assert count_files(store.root, 'deltas') == 4
+
+    def test_reverted_config_reuses_stored_version(self, store):
+        for version in (0, 1, 0):
+            store.commit('switch1', make_config(version))
+        history = store.history('switch1')
+        assert history[0]['sha256'] == history[2]['sha256']
+        assert history[2]['chain'] == 0
+        assert count_files(store.root, 'deltas') == 1
+
+    def test_empty_config_is_rejected(self, store):
+        with pytest.raises(ValueError):
+            store.commit('switch1', [])
+
+    def test_diff(self, store):
+        store.commit('switch1', make_config(0))
+        store.commit('switch1', make_config(1))
+        diff = store.diff('switch1').splitlines()
+        assert '-vlan 8' in diff
+        assert '+vlan changed 1' in diff
+
+    def test_diff_of_single_version(self, store):
+        store.commit('switch1', make_config(0))
+        diff = store.diff('switch1').splitlines()
+        assert diff[0] == '--- /dev/null'
+        assert '+Running configuration:' in diff
+
+    def test_hashing_sink(self):
+        sink = HashingSink()
+        for line in make_config(0):
+            sink(line)
+        assert sink.lines == make_config(0)
+        assert sink.sha256 == config_digest(make_config(0))
+
+
+class FakeDriver(object):
+    """HpProcurveDriver double streaming a fixed configuration."""
+
+    config = []
+    fail_in = None
+    closed = []
+
+    def __init__(self, hostname, username, password, timeout=60, optional_args=None):
+        self.hostname = hostname
+        self.device = None
+
+    def open(self):
+        if self.fail_in == 'connect':
+            raise ConnectionError('connection refused')
+        self.device = object()
+        if self.fail_in == 'open':
+            raise RuntimeError('show version failed')
+
+    def close(self):
+        self.closed.append(self.hostname)
+
+    def stream_config(self, sink, retrieve='running'):
+        for line in self.config:
+            sink(line)
+        return len(self.config)
+
+
+@pytest.mark.parametrize('config', [
+    [],
+    ['', ''],
+    ['hostname "switch1"', 'vlan 1'],
+])
+def test_backup_device_rejects_incomplete_config(store, monkeypatch, config):
+    monkeypatch.setattr(backup, 'HpProcurveDriver', FakeDriver)
+    monkeypatch.setattr(FakeDriver, 'config', config)
+    result = backup.backup_device(store, 'switch1', 'user', 'pass')
+    assert result['status'] == 'failed'
+    assert result['error']
+    assert store.history('switch1') == []
+
+
+def test_backup_devices(store, monkeypatch):
+    monkeypatch.setattr(backup, 'HpProcurveDriver', FakeDriver)
+    monkeypatch.setattr(FakeDriver, 'config', make_config(0))
+    devices = [{'hostname': f'switch{idx}', 'username': 'user', 'password': 'pass'}
+               for idx in range(5)]
+    results = backup.backup_devices(store, devices, max_workers=3)
+    assert [result['hostname'] for result in results] == [d['hostname'] for d in devices]
+    assert [result['status'] for result in results] == ['new'] * 5
+    assert count_files(store.root, 'objects') == 1
+
+
+@pytest.mark.parametrize('fail_in, closed', [('open', ['switch1']), ('connect', [])])
+def test_backup_device_closes_after_failed_open(store, monkeypatch, fail_in, closed):
+    monkeypatch.setattr(backup, 'HpProcurveDriver', FakeDriver)
+    monkeypatch.setattr(FakeDriver, 'fail_in', fail_in)
+    monkeypatch.setattr(FakeDriver, 'closed', [])
+    result = backup.backup_device(store, 'switch1', 'user', 'pass')
+    assert result['status'] == 'failed'
+    assert FakeDriver.closed == closed
+
+
+def test_non_ascii_config_round_trip(tmp_path):
+    """ Configurations are read back as UTF-8 whatever the locale is """
+    script = textwrap.dedent("""
+        import sys
+        from napalm_hp_procurve.backup import ConfigBackupStore, config_digest
+        store = ConfigBackupStore(sys.argv[1])
+        first = ['Running configuration:', 'banner motd "Zugang nur f\\u00fcr Admins"']
+        second = first + ['interface 1 name "B\\u00fcro \\u260e"']
+        store.commit('switch1', first)
+        store.commit('switch1', second)
+        assert store.get('switch1', 0) == first
+        assert store.get('switch1') == second
+        assert config_digest(second) == store.history('switch1')[-1]['sha256']
+    """)
+    env = dict(os.environ, LC_ALL='C', LANG='C', PYTHONUTF8='0', PYTHONCOERCECLOCALE='0',
+               PYTHONPATH=os.pathsep.join(sys.path))
+    subprocess.run([sys.executable, '-c', script, str(tmp_path)], env=env, check=True)
@@ -0,0 +1,104 @@
+"""Tests for the compact MAC address table."""
+
+import json
+import sys
+
+import pytest
+
+from napalm_hp_procurve.utils.mac_table import (
+    MacAddressTable,
+    int_to_mac,
+    json_default,
+    mac_to_int,
+)
+
+
+ROWS = [
+    {'mac': '002347-5babcd', 'interface': 'A23', 'vlan': '1', 'state': 'Learned'},
+    {'mac': '005012-01abcd', 'interface': 'Trk1', 'vlan': '10', 'state': 'Learned'},
+    {'mac': '1cdf0f-b4abcd', 'interface': 'Trk1', 'vlan': '10', 'state': 'Static'},
+    {'mac': '005012-01abcd', 'interface': 'Trk1', 'vlan': '20', 'state': 'Learned'},
+]
+
+
+def napalm_entry(mac, interface, vlan, static=False):
+    return {
+        'mac': mac,
+        'interface': interface,
+        'vlan': vlan,
+        'static': static,
+        'active': True,
+        'moves': -1,
+        'last_move': -1.0,
+    }
+
+
+EXPECTED = [
+    napalm_entry('00:23:47:5b:ab:cd', 'A23', 1),
+    napalm_entry('00:50:12:01:ab:cd', 'Trk1', 10),
+    napalm_entry('1c:df:0f:b4:ab:cd', 'Trk1', 10, static=True),
+    napalm_entry('00:50:12:01:ab:cd', 'Trk1', 20),
+]
+
+
+@pytest.fixture
+def table():
+    return MacAddressTable.from_rows(ROWS)
+
+
+@pytest.mark.parametrize('mac', ['1cdf0f-b4abcd', '1cdf-0fb4-abcd', '1C:DF:0F:B4:AB:CD'])
+def test_mac_to_int(mac):
+    assert mac_to_int(mac) == 0x1cdf0fb4abcd
+    assert int_to_mac(mac_to_int(mac)) == '1c:df:0f:b4:ab:cd'
+
+
+def test_indexing(table):
+    assert len(table) == 4
+    assert table[0] == EXPECTED[0]
+    assert table[-1] == EXPECTED[-1]
+    assert table[1:3] == EXPECTED[1:3]
+    assert list(table) == EXPECTED
+    with pytest.raises(IndexError):
+        table[4]
+
+
+def test_interned_values(table):
+    assert table.interfaces == ['A23', 'Trk1']
+    assert table[1]['interface'] is table[2]['interface']
+
+
+def test_find(table):
+    assert table.find('0050.1201.abcd') == [EXPECTED[1], EXPECTED[3]]
+    assert table.find(0x1cdf0fb4abcd) == [EXPECTED[2]]
+    assert table.find('aabb-ccdd-eeff') == []
+
+
+def test_rows(table):
+    assert list(table.rows())[2] == (0x1cdf0fb4abcd, 'Trk1', 10, 'Static')
+
+
+def test_equality(table):
+    assert table == EXPECTED
+    assert table == tuple(EXPECTED)
+    assert table != EXPECTED[:3]
+    assert table == MacAddressTable.from_rows(ROWS)
+    assert table != MacAddressTable.from_rows(ROWS[:2])
+
+
+def test_serialization(table):
+    assert table.to_list() == EXPECTED
+    assert json.loads(json.dumps(table.to_list())) == EXPECTED
+    assert json.loads(json.dumps(table, default=json_default)) == EXPECTED
+    with pytest.raises(TypeError):
+        json.dumps(object(), default=json_default)
+
+
+def test_normalize_port_name():
+    table = MacAddressTable.from_rows(ROWS[:1], normalize_port_name=str.lower)
+    assert table[0]['interface'] == 'a23'
+
+
+def test_smaller_than_dicts(table):
+    rows = [dict(row) for row in ROWS * 500]
+    big_table = MacAddressTable.from_rows(rows)
+    assert big_table.memory_size() < sum(sys.getsizeof(row) for row in rows)
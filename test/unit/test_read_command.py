@@ -0,0 +1,205 @@
+"""Tests for reading command output from the channel."""
+
+import pytest
+from napalm.base.exceptions import CommandErrorException
+
+from napalm_hp_procurve import HpProcurveDriver
+
+
+PROMPT = '\r\nHP-2920# '
+
+
+class FakeChannel(object):
+    """Netmiko connection double replaying scripted output.
+
+    script maps what is written to the channel to a list of responses, one
+    per write (the last one is repeated). A response is the list of chunks
+    returned by consecutive reads.
+    """
+    base_prompt = 'HP-2920'
+    RETURN = '\n'
+    global_delay_factor = 1
+
+    def __init__(self, script):
+        self.script = script
+        self.written = []
+        self.queue = []
+        self.cleared = 0
+
+    def write_channel(self, data):
+        self.written.append(data)
+        responses = self.script.get(data.rstrip('\n'), [[]])
+        self.queue.extend(responses.pop(0) if len(responses) > 1 else responses[0])
+
+    def read_channel(self):
+        if self.queue:
+            return self.queue.pop(0)
+        return ''
+
+    def clear_buffer(self):
+        self.cleared += 1
+        self.queue = []
+
+    @staticmethod
+    def strip_ansi_escape_codes(data):
+        return data.replace('\x1b[2K', '')
+
+
+@pytest.fixture
+def driver(tmp_path):
+    device = HpProcurveDriver(
+        'switch1', 'user', 'pass',
+        optional_args={'timing_profile_file': str(tmp_path / 'timing.json')})
+    device.timing_profile = device.timing_store.get('J9728A', 'WB.16.02.0012')
+    return device
+
+
+def test_command_output(driver):
+    driver.device = FakeChannel({
+        'show version': [['show version\r\n', 'Image stamp:    /ws/swbuild\r\n',
+                          '                WB.16.02.0012\r\n' + PROMPT]],
+    })
+    output = driver._send_command('show version')
+    assert output == 'Image stamp:    /ws/swbuild\n                WB.16.02.0012'
+    assert driver.device.written == ['show version\n']
+    assert driver.timing_profile._stats('show version')['samples'] == 1
+
+
+def test_empty_output_is_not_retried(driver):
+    driver.device = FakeChannel({'no page': [['no page\r\n' + PROMPT]]})
+    assert driver._send_command('no page') == ''
+    assert driver.device.written == ['no page\n']
+    assert driver.timing_profile._stats('no page')['backoff'] == 1.0
+
+
+def test_pager_is_answered_without_backoff(driver):
+    driver.device = FakeChannel({
+        'show mac-address': [['show mac-address\r\n', 'line 1\r\n',
+                              '-- MORE --, next page: Space, quit: q']],
+        ' ': [['\x1b[2Kline 2\r\n' + PROMPT]],
+    })
+    assert driver._send_command('show mac-address') == 'line 1\nline 2'
+    assert driver.device.written == ['show mac-address\n', ' ']
+    assert driver.timing_profile._stats('show mac-address')['backoff'] == 1.0
+
+
+def test_retry_after_missing_prompt(driver, monkeypatch):
+    monkeypatch.setattr(driver, '_idle_timeout', lambda command: 0.2)
+    driver.device = FakeChannel({
+        'show telnet': [
+            ['show telnet\r\n', 'partial\r\n'],
+            ['show telnet\r\n', 'partial\r\n', 'complete\r\n' + PROMPT],
+        ],
+    })
+    assert driver._send_command('show telnet') == 'partial\ncomplete'
+    assert driver.device.written == ['show telnet\n', 'show telnet\n']
+    # channel is drained before the command is sent again
+    assert driver.device.cleared == 3
+    # backed off once, then decayed by the successful retry
+    assert driver.timing_profile._stats('show telnet')['backoff'] == pytest.approx(1.8)
+
+
+def test_pager_is_quit_before_retry(driver, monkeypatch):
+    monkeypatch.setattr(driver, '_idle_timeout', lambda command: 0.2)
+    driver.device = FakeChannel({
+        'show telnet': [
+            ['show telnet\r\n', 'partial\r\n'],
+            ['show telnet\r\n', 'complete\r\n' + PROMPT],
+        ],
+    })
+    # the device shows the pager only after the read was given up
+    read_channel = driver.device.read_channel
+    pages = [''] * 6 + ['-- MORE --, next page: Space, quit: q']
+
+    def slow_read_channel():
+        if len(driver.device.written) == 1 and pages:
+            return read_channel() or pages.pop(0)
+        return read_channel()
+    driver.device.read_channel = slow_read_channel
+    driver.device.script['q'] = [[PROMPT]]
+    assert driver._send_command('show telnet') == 'complete'
+    assert driver.device.written == ['show telnet\n', 'q', 'show telnet\n']
+
+
+def test_close_ignores_profile_save_errors(driver, tmp_path):
+    driver.device = FakeChannel({})
+    driver.device.disconnect = lambda: None
+    driver.timing_store.filename = str(tmp_path / 'missing' / 'timing.json')
+    driver.timing_profile.record('show version', first_byte=0.2, max_gap=0.0)
+    driver.close()
+
+
+RUNNING_CONFIG = [
+    'show running-config\r\n',
+    '\r\nRunning configuration:\r\n\r\n',
+    'hostname "switch1"\r\n',
+    'password manager user-name "admin" sha1 "0123456789abcdef"\r\n',
+    '-- MORE --, next page: Space, quit: q',
+]
+
+
+@pytest.fixture
+def manager(driver, monkeypatch):
+    monkeypatch.setattr(driver, 'privilege_escalation', lambda: 0)
+    monkeypatch.setattr(driver, 'disable_pageing', lambda: None)
+    driver.device = FakeChannel({
+        'show running-config': [RUNNING_CONFIG],
+        ' ': [['snmp-server community "public" unrestricted\r\n', PROMPT]],
+    })
+    return driver
+
+
+def test_stream_config(manager):
+    lines = []
+    assert manager.stream_config(lines.append) == 7
+    assert lines == [
+        '', 'Running configuration:', '', 'hostname "switch1"',
+        'password manager user-name "admin" sha1 "0123456789abcdef"',
+        'snmp-server community "public" unrestricted', '',
+    ]
+    assert manager.device.written == ['show running-config\n', ' ']
+
+
+def test_stream_config_timeout(driver, monkeypatch):
+    monkeypatch.setattr(driver, 'privilege_escalation', lambda: 0)
+    monkeypatch.setattr(driver, 'disable_pageing', lambda: None)
+    monkeypatch.setattr(driver, '_idle_timeout', lambda command: 0.2)
+    driver.device = FakeChannel({'show running-config': [RUNNING_CONFIG[:3]]})
+    with pytest.raises(CommandErrorException):
+        driver.stream_config(lambda line: None)
+    stats = driver.timing_profile._stats('show running-config')
+    assert stats['backoff'] == 2.0
+
+
+def test_get_config(manager):
+    manager.device.script['show config'] = [['show config\r\n', 'Startup configuration:\r\n',
+                                             PROMPT]]
+    config = manager.get_config()
+    assert config['running'].startswith('\nRunning configuration:\n')
+    assert config['startup'] == 'Startup configuration:\n'
+    assert config['candidate'] == ''
+
+
+def test_get_config_sanitized(manager):
+    config = manager.get_config(retrieve='running', sanitized=True)
+    assert 'password manager user-name "admin" sha1 "<removed>"' in config['running']
+    assert 'snmp-server community "<removed>" unrestricted' in config['running']
+    assert '0123456789abcdef' not in config['running']
+
+
+@pytest.mark.parametrize('kwargs', [{'full': True}, {'format': 'json'}])
+def test_get_config_unsupported(manager, kwargs):
+    with pytest.raises(NotImplementedError):
+        manager.get_config(**kwargs)
+
+
+def test_missing_prompt_on_retry_raises(driver, monkeypatch):
+    monkeypatch.setattr(driver, '_idle_timeout', lambda command: 0.2)
+    driver.device = FakeChannel({
+        'show mac-address': [['show mac-address\r\n', 'aa-bb 1 Learned A1\r\n',
+                              'bb-cc 1 Learned A2\r\n']],
+    })
+    with pytest.raises(CommandErrorException):
+        driver._send_command('show mac-address')
+    assert driver.device.written == ['show mac-address\n', 'show mac-address\n']
+    assert driver.timing_profile._stats('show mac-address')['backoff'] == 4.0
@@ -0,0 +1,157 @@
+"""Tests for adaptive timing profiles."""
+
+import json
+
+import pytest
+
+from napalm_hp_procurve.utils import timing
+from napalm_hp_procurve.utils.timing import TimingProfile, TimingProfileStore
+
+
+class TestTimingProfile(object):
+    """Test record and backoff math."""
+
+    def test_unknown_command_uses_default(self):
+        profile = TimingProfile('J9728A|WB.16')
+        assert profile.delay_factor('show version') == timing.DEFAULT_DELAY_FACTOR
+        assert profile.idle_timeout('show version') == 2 * timing.DEFAULT_DELAY_FACTOR
+
+    def test_fast_command_gets_faster(self):
+        profile = TimingProfile('J9728A|WB.16')
+        for _ in range(5):
+            profile.record('show version', first_byte=0.2, max_gap=0.05)
+        assert profile.delay_factor('show version') == timing.MIN_DELAY_FACTOR
+        assert profile.dirty
+
+    def test_big_output_does_not_get_slower(self):
+        """ A command streaming for 6 s in chunks 0.1 s apart is not slow """
+        profile = TimingProfile('J9728A|WB.16')
+        factors = []
+        for _ in range(20):
+            # 60 chunks 0.1 s apart, transfer takes 6 s in total
+            profile.record('show running-config', first_byte=0.3, max_gap=0.1)
+            factors.append(profile.delay_factor('show running-config'))
+        assert factors == sorted(factors, reverse=True)
+        assert factors[-1] < timing.DEFAULT_DELAY_FACTOR
+        assert profile.idle_timeout('show running-config') <= 1.0
+
+    def test_slow_first_byte_sets_window(self):
+        profile = TimingProfile('J8770A|L.11')
+        profile.record('show mac-address', first_byte=3.0, max_gap=0.5)
+        # silence window is SILENCE_MARGIN times the longest pause
+        assert profile.idle_timeout('show mac-address') == pytest.approx(6.0)
+
+    def test_long_pause_decays(self):
+        profile = TimingProfile('J8770A|L.11')
+        profile.record('show version', first_byte=3.0, max_gap=0.0)
+        slow = profile.delay_factor('show version')
+        for _ in range(10):
+            profile.record('show version', first_byte=0.2, max_gap=0.0)
+        assert profile.delay_factor('show version') < slow
+
+    def test_backoff_when_prompt_not_seen(self):
+        profile = TimingProfile('J8770A|L.11')
+        profile.record('show version', first_byte=0.5, max_gap=0.0)
+        before = profile.delay_factor('show version')
+        profile.record('show version', first_byte=0.0, max_gap=0.0, prompt_seen=False)
+        assert profile.delay_factor('show version') == pytest.approx(2 * before)
+        for _ in range(10):
+            profile.record('show version', first_byte=0.0, max_gap=0.0, prompt_seen=False)
+        assert profile.delay_factor('show version') == timing.MAX_DELAY_FACTOR
+
+    def test_backoff_decays(self):
+        profile = TimingProfile('J8770A|L.11')
+        profile.record('show version', first_byte=0.5, max_gap=0.0, prompt_seen=False)
+        assert profile._stats('show version')['backoff'] == timing.BACKOFF_FACTOR
+        for _ in range(20):
+            profile.record('show version', first_byte=0.5, max_gap=0.0)
+        assert profile._stats('show version')['backoff'] == 1.0
+
+    def test_arguments_share_statistics(self):
+        profile = TimingProfile('J8770A|L.11')
+        profile.record('show mac-address 0011-2233-4455', first_byte=3.0, max_gap=0.0)
+        assert profile.idle_timeout('show mac-address') == pytest.approx(6.0)
+
+    def test_global_delay_factor_not_below_one(self):
+        profile = TimingProfile('J9728A|WB.16')
+        assert profile.global_delay_factor() == timing.DEFAULT_DELAY_FACTOR
+        profile.record('show version', first_byte=0.1, max_gap=0.0)
+        assert profile.delay_factor('show version') == timing.MIN_DELAY_FACTOR
+        assert profile.global_delay_factor() == timing.MIN_GLOBAL_DELAY_FACTOR
+
+
+class TestTimingProfileStore(object):
+    """Test persistence of timing profiles."""
+
+    def test_save_and_load(self, tmp_path):
+        filename = str(tmp_path / 'timing.json')
+        store = TimingProfileStore(filename)
+        profile = store.get('J9728A', 'WB.16.02.0012')
+        assert profile.key == 'J9728A|WB.16'
+        store.bind_host('switch1', profile)
+        profile.record('show version', first_byte=0.2, max_gap=0.0)
+        store.save()
+
+        store = TimingProfileStore(filename)
+        assert store.for_host('switch1').delay_factor('show version') == \
+            timing.MIN_DELAY_FACTOR
+        assert store.for_host('switch2') is None
+
+    def test_save_merges_other_writers(self, tmp_path):
+        filename = str(tmp_path / 'timing.json')
+        first = TimingProfileStore(filename)
+        second = TimingProfileStore(filename)
+        first.bind_host('switch1', first.get(None, 'K.16.01'))
+        first.save()
+        second.bind_host('switch2', second.get('J8770A', 'L.11.45'))
+        second.save()
+        with open(filename) as fh:
+            hosts = json.load(fh)['hosts']
+        assert hosts == {'switch1': 'unknown|K.16', 'switch2': 'J8770A|L.11'}
+
+    def test_corrupt_file_is_ignored(self, tmp_path):
+        filename = tmp_path / 'timing.json'
+        filename.write_text('{not json')
+        store = TimingProfileStore(str(filename))
+        assert store.profiles == {}
+
+
+class TestMergeOnSave(object):
+    """Test drivers sharing a profile do not drop each other's samples."""
+
+    def test_commands_of_both_stores_are_kept(self, tmp_path):
+        filename = str(tmp_path / 'timing.json')
+        first = TimingProfileStore(filename)
+        second = TimingProfileStore(filename)
+        first.get('J9728A', 'WB.16').record('show version', 0.2, 0.0, prompt_seen=False)
+        second.get('J9728A', 'WB.16').record('show running-config', 0.3, 0.1)
+        first.save()
+        second.save()
+
+        profile = TimingProfileStore(filename).get('J9728A', 'WB.16')
+        assert profile._stats('show version')['backoff'] == timing.BACKOFF_FACTOR
+        assert profile._stats('show running-config')['samples'] == 1
+        # the saving store picks up what the other one learned
+        assert second.get('J9728A', 'WB.16')._stats('show version') is not None
+
+    def test_same_command_keeps_newer_entry_and_larger_backoff(self, tmp_path):
+        filename = str(tmp_path / 'timing.json')
+        first = TimingProfileStore(filename)
+        second = TimingProfileStore(filename)
+        first.get('J9728A', 'WB.16').record('show version', 0.2, 0.0, prompt_seen=False)
+        first.save()
+        second.get('J9728A', 'WB.16').record('show version', 0.4, 0.0)
+        second.save()
+
+        stats = TimingProfileStore(filename).get('J9728A', 'WB.16')._stats('show version')
+        assert stats['first_byte'] == 0.4
+        assert stats['backoff'] == timing.BACKOFF_FACTOR
+
+    def test_merge_stats(self):
+        ours = {'first_byte': 0.2, 'backoff': 1.0, 'updated': 2.0}
+        theirs = {'first_byte': 0.5, 'backoff': 4.0, 'updated': 1.0}
+        assert timing.merge_stats(ours, theirs) == {
+            'first_byte': 0.2, 'backoff': 4.0, 'updated': 2.0}
+        assert timing.merge_stats(ours, None) is ours
+        assert timing.merge_stats(theirs, ours) == {
+            'first_byte': 0.2, 'backoff': 4.0, 'updated': 2.0}